@@ -0,0 +1,64 @@
+"""
+Small thread-safe LRU cache shared by the ion and spectrum code.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Least-recently-used mapping bounded by entry count and/or by the total
+    size of its values as measured by sizeof. The lock is only held for
+    dict operations, never while a value is being computed, so two threads
+    may compute the same value; the last one stored wins.
+    """
+
+    def __init__(
+        self,
+        max_items: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Returns the cached value (marking it most recently used), or None.
+        """
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None and self._sizeof is not None:
+                self._bytes -= self._sizeof(old)
+            self._data[key] = value
+            if self._sizeof is not None:
+                self._bytes += self._sizeof(value)
+
+            while self._data and (
+                (self.max_items is not None and len(self._data) > self.max_items)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                _, evicted = self._data.popitem(last=False)
+                if self._sizeof is not None:
+                    self._bytes -= self._sizeof(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
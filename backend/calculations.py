@@ -1,6 +1,18 @@
+import io
+import os
+import re
 import numpy as np
+from dataclasses import dataclass
 from functools import lru_cache
-from typing import List
+from typing import List, NamedTuple
+
+from .cache import LRUCache
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; fall back to pure-Python/NumPy code paths
+    njit = None
+    prange = range
 
 # Standard atomic weights and masses
 ATOM_MASSES = {
@@ -17,11 +29,16 @@ AA_MASS = {'G': 57.02146374, 'A': 71.03711381, 'S': 87.03202844, 'P': 97.0527638
                'Q': 128.0585775, 'K': 128.0949631, 'E': 129.0425931, 'M': 131.0404846, 'H': 137.0589119, 'F': 147.0684139, 'U': 150.9536334, 'R': 156.1011111, 'Y': 163.0633286, 'W': 186.079313,
                'O': 237.1477269, 'n': 0.00000}
 
-@lru_cache(maxsize=50000)
-def pep_by_ion_calc(peptide: str) -> np.ndarray:
+# ASCII-indexed residue masses (-1.0 marks non-residue bytes), replacing
+# per-character dict lookups with array loads
+AA_MASS_LUT = np.full(256, -1.0, dtype=np.float64)
+for _aa, _mass in AA_MASS.items():
+    AA_MASS_LUT[ord(_aa)] = _mass
+
+def _parse_residues_py(peptide: str) -> List[float]:
     """
-    Calculates b and y ions for a peptide sequence, handling [mass] or (mass) modifications.
-    Returns concatenated array of b-ions then y-ions.
+    Returns per-residue masses, folding [mass] or (mass) modifications
+    into the preceding residue (or the first one for N-terminal mods).
     """
     b_ion_vals = []
     
@@ -65,9 +82,55 @@ def pep_by_ion_calc(peptide: str) -> np.ndarray:
         else:
             i += 1
             
-    b_ions_arr = np.array(b_ion_vals)
+    return b_ion_vals
+
+class IonLadder(NamedTuple):
+    """
+    Singly charged (MH+) b-ion and y-ion masses of a peptide with n residues.
+    b is [b1, b2, ... b(n-1)]; y is [y(n-1), y(n-2), ... y1, yn],
+    where yn is the full peptide (precursor MH+).
+    """
+    b: np.ndarray
+    y: np.ndarray
+
+# Bounded LRU cache for pep_by_ion_calc, keyed by canonical peptide
+PEPTIDE_CACHE_SIZE = 50000
+_PEPTIDE_CACHE = LRUCache(max_items=PEPTIDE_CACHE_SIZE)
+
+_MOD_DELIMITERS = str.maketrans("()", "[]")
+
+def _canonical_peptide(peptide: str) -> str:
+    """
+    Normalizes spellings that describe the same peptide: (mass) becomes [mass]
+    and surrounding whitespace is dropped. Residues stay case-sensitive
+    because lower-case n marks the N-terminus.
+    """
+    return peptide.strip().translate(_MOD_DELIMITERS)
+
+def pep_by_ion_calc(peptide: str) -> IonLadder:
+    """
+    Calculates b and y ions for a peptide sequence, handling [mass] or (mass) modifications.
+    Returns the cumulative b-ions and the y-ions as a read-only IonLadder.
+    """
+    key = _canonical_peptide(peptide)
+    ladder = _PEPTIDE_CACHE.get(key)
+    if ladder is None:
+        ladder = _compute_ion_ladder(key)
+        _PEPTIDE_CACHE.put(key, ladder)
+    return ladder
+
+def _compute_ion_ladder(peptide: str) -> IonLadder:
+    if '[' not in peptide and '(' not in peptide:
+        # Unmodified peptide: a single LUT gather, unknown characters are skipped
+        buf = np.frombuffer(peptide.encode('ascii', 'ignore'), dtype=np.uint8)
+        b_ions_arr = AA_MASS_LUT[buf]
+        b_ions_arr = b_ions_arr[b_ions_arr >= 0.0]
+    else:
+        # Modified peptide: modification masses are parsed with float()
+        b_ions_arr = np.array(_parse_residues_py(peptide), dtype=np.float64)
+        
     if len(b_ions_arr) == 0:
-        return np.array([])
+        return IonLadder(np.array([]), np.array([]))
         
     # b1 = aa1 + H+
     b_ions_arr[0] += PROTON_MASS
@@ -77,152 +140,353 @@ def pep_by_ion_calc(peptide: str) -> np.ndarray:
     
     total_mh = b_ions_cumulative[-1] + (18.010564684) # WATER
     
-    # y_ions calculation matching user logic
-    y_ions = total_mh - b_ions_cumulative + PROTON_MASS
+    # Only the n-1 real fragments: bn (no cleavage) and y0 are never generated
+    b_ions = b_ions_cumulative[:-1]
     
-    # Override last y-ion to be total mass (y_n)
+    # y_ions calculation matching user logic, plus the full peptide as yn
+    y_ions = np.empty(len(b_ions_cumulative), dtype=np.float64)
+    y_ions[:-1] = total_mh - b_ions + PROTON_MASS
     y_ions[-1] = total_mh
     
-    return np.concatenate((b_ions_cumulative, y_ions), axis=0)
+    # Cached results are shared between callers
+    b_ions.flags.writeable = False
+    y_ions.flags.writeable = False
+    return IonLadder(b_ions, y_ions)
+
+# Ion series encoded as small integer codes in the array kernels
+ION_TYPES = ("b", "y")
+
+# Precomputed ion labels indexed by fragment length - 1, one row per series
+MAX_LABEL_LENGTH = 256
+B_LABELS = tuple(f"b{i}" for i in range(1, MAX_LABEL_LENGTH + 1))
+Y_LABELS = tuple(f"y{i}" for i in range(1, MAX_LABEL_LENGTH + 1))
+ION_LABEL_TABLE = np.array([B_LABELS, Y_LABELS], dtype=object)
 
-def calculate_ions(sequence: str, charge: int) -> List[dict]:
+def _ion_labels(type_codes: np.ndarray, lengths: np.ndarray) -> List[str]:
+    if len(lengths) and lengths.max() > MAX_LABEL_LENGTH:
+        return [f"{ION_TYPES[t]}{length}" for t, length in zip(type_codes.tolist(), lengths.tolist())]
+    return ION_LABEL_TABLE[type_codes, lengths - 1].tolist()
+
+@dataclass
+class PeakArray:
     """
-    Calculates theoretical ions using the robust PTM parser.
+    Observed peaks stored as parallel m/z and intensity columns.
     """
-    # 1. Parse and calculate base (singly charged) ions
-    # The result array has [b1...bn, y(n-1)...y1??]
-    # We need to identify which is which.
+    mz: np.ndarray
+    intensity: np.ndarray
     
-    # Calculate pure lengths without mods for labeling
-    # We need to know how many residues.
-    # We can run the parser again or just use the length of b_ions (half the array).
-    
-    masses = pep_by_ion_calc(sequence)
-    
-    if len(masses) == 0:
-        return []
+    def __len__(self) -> int:
+        return len(self.mz)
         
-    num_residues = len(masses) // 2
-    b_masses = masses[:num_residues]
-    y_masses = masses[num_residues:]
-    
-    ions = []
-    
-    # Generate b-ions
-    for i, m in enumerate(b_masses):
-        # b1, b2 ...
-        ion_idx = i + 1
-        for z in range(1, charge + 1):
-             # m is singly charged (MH+)
-             # m = Neutral + H
-             # mz = (Neutral + zH) / z = (m - H + zH) / z = (m + (z-1)H) / z
-             mz = (m + (z - 1) * PROTON_MASS) / z
-             ions.append({
-                 "type": f"b{ion_idx}",
-                 "charge": z,
-                 "mz": mz
-             })
-
-    # Generate y-ions
-    # y_masses from user code:
-    # y[0] corresponds to removing b1 -> y_(n-1)
-    # y[-1] corresponds to full mass -> y_n
-    
-    # Wait, usually:
-    # y1 is suffix length 1.
-    # User code: y = M - b + H.
-    # If b=b1 (prefix 1), y = M - b1 + H = (ResTotal + H2O + H) - (Res1 + H) + H = ResSuffix + H2O + H.
-    # This is MH+ of suffix length (n-1). = y_(n-1).
-    
-    # So y_masses[0] is y_(n-1)
-    # y_masses[-1] is y_(0)? No users code set y[-1] = total. So y_n.
-    
-    # Let's map indices:
-    # i goes 0 to n-1.
-    # len = n_residues.
-    # y_index = n_residues - (i + 1) ? 
-    # No, if i=0 (b1), we get y_(n-1).
-    # If i = n-1 (bn), we get y_0? (which is usually not valid, or H2O+H)
-    
-    # User code override y[-1] = total. Total is y_n.
-    # So y_masses is [y_n-1, y_n-2, ... y_1? ... y_n?]
-    # This order is confusing.
-    
-    # Let's simple check user logic: `y_ions = total - b + H`.
-    # b is [b1, b2, ... bn]
-    # y is [y(n-1), y(n-2), ... y0]
-    
-    # So:
-    # i=0: b1 -> y(n-1)
-    # i=n-2: b(n-1) -> y1
-    # i=n-1: bn -> y0 (replaced by y_n)
-    
-    for i, m in enumerate(y_masses):
-        if i == num_residues - 1:
-            ion_label = f"y{num_residues}" # The override (Full peptide)
-        else:
-            ion_label = f"y{num_residues - 1 - i}"
-            
-        # Filter mostly y0?
-        if ion_label == "y0": continue
+    @classmethod
+    def from_arrays(cls, mz: np.ndarray, intensity: np.ndarray, dtype=np.float64) -> "PeakArray":
+        # Mismatched columns mean no usable peaks
+        if len(mz) != len(intensity):
+            mz = intensity = np.array([])
+        return cls(
+            mz=np.asarray(mz, dtype=dtype),
+            intensity=np.asarray(intensity, dtype=dtype),
+        )
         
-        for z in range(1, charge + 1):
-             mz = (m + (z - 1) * PROTON_MASS) / z
-             ions.append({
-                 "type": ion_label,
-                 "charge": z,
-                 "mz": mz
-             })
-             
-    return ions
+    @classmethod
+    def from_dicts(cls, peaks: List[dict]) -> "PeakArray":
+        return cls(
+            mz=np.fromiter((p["mz"] for p in peaks), dtype=np.float64, count=len(peaks)),
+            intensity=np.fromiter((p["intensity"] for p in peaks), dtype=np.float64, count=len(peaks)),
+        )
+        
+    def to_dicts(self) -> List[dict]:
+        return [{"mz": m, "intensity": i} for m, i in zip(self.mz.tolist(), self.intensity.tolist())]
 
-def parse_spectrum(spectrum_text: str):
-    import re
-    peaks = []
-    for line in spectrum_text.strip().splitlines():
-        line = line.strip()
-        if not line: continue
-        try:
-            parts = re.split(r'\s+', line)
-            if len(parts) >= 2:
-                peaks.append({"mz": float(parts[0]), "intensity": float(parts[1])})
-        except: pass
-    return peaks
+# One packed record per theoretical ion; type_code indexes ION_TYPES and
+# length is the number of residues in the fragment
+ION_DT = np.dtype([('mz', 'f8'), ('charge', 'i2'), ('type_code', 'u1'), ('length', 'u2')])
 
-def match_ions(peaks, theoretical_ions, tolerance=0.5):
+@dataclass
+class IonArray:
     """
-    Matches theoretical ions to observed peaks within a tolerance (Da).
-    Greedy matching: for each theoretical ion, find the closest observed peak.
-    Returns list of matched annotations.
-    """
-    matches = []
-    # Sort peaks by intensity? Or just iterate?
-    # Iterate theoretical ions
-    for ion in theoretical_ions:
-        target_mz = ion["mz"]
+    Theoretical ions stored in a single ION_DT record buffer.
+    Columns are exposed as field views, e.g. ions.mz is records['mz'].
+    """
+    records: np.ndarray
+    
+    def __len__(self) -> int:
+        return len(self.records)
+        
+    @property
+    def mz(self) -> np.ndarray:
+        return self.records['mz']
         
-        best_peak = None
-        min_diff = float('inf')
+    @property
+    def charge(self) -> np.ndarray:
+        return self.records['charge']
         
-        for peak in peaks:
-            diff = abs(peak["mz"] - target_mz)
-            if diff <= tolerance and diff < min_diff:
-                min_diff = diff
-                best_peak = peak
+    @property
+    def type_code(self) -> np.ndarray:
+        return self.records['type_code']
         
-        if best_peak:
-            # Check if this annotation already exists for this peak?
-            # A peak might be multiple things? 
-            # For simplicity, let's just add the match. 
-            # The frontend can handle overlapping labels.
-            matches.append({
-                "peak_mz": best_peak["mz"],
-                "peak_intensity": best_peak["intensity"],
-                "ion_type": ion["type"],
-                "ion_charge": ion["charge"],
-                "theoretical_mz": ion["mz"],
-                "error": min_diff
-            })
+    @property
+    def length(self) -> np.ndarray:
+        return self.records['length']
+        
+    def to_dicts(self) -> List[dict]:
+        return [
+            {"type": label, "charge": z, "mz": m}
+            for m, label, z in zip(self.mz.tolist(), _ion_labels(self.type_code, self.length), self.charge.tolist())
+        ]
+
+@dataclass
+class MatchArray:
+    """
+    Ion/peak matches stored as parallel columns.
+    peak_index refers to the PeakArray the ions were matched against.
+    """
+    peak_index: np.ndarray
+    peak_mz: np.ndarray
+    peak_intensity: np.ndarray
+    ion_type_code: np.ndarray
+    ion_length: np.ndarray
+    ion_charge: np.ndarray
+    theoretical_mz: np.ndarray
+    error: np.ndarray
+    
+    def __len__(self) -> int:
+        return len(self.peak_index)
+        
+    def to_dicts(self) -> List[dict]:
+        return [
+            {
+                "peak_mz": pm,
+                "peak_intensity": pi,
+                "ion_type": label,
+                "ion_charge": z,
+                "theoretical_mz": tm,
+                "error": e
+            }
+            for pm, pi, label, z, tm, e in zip(
+                self.peak_mz.tolist(), self.peak_intensity.tolist(),
+                _ion_labels(self.ion_type_code, self.ion_length), self.ion_charge.tolist(),
+                self.theoretical_mz.tolist(), self.error.tolist()
+            )
+        ]
+
+# Number of (sequence, charge) ion tables kept in memory
+ION_CACHE_SIZE = int(os.environ.get("PROTVIEW_ION_CACHE_SIZE", 10000))
+
+@lru_cache(maxsize=256)
+def _ion_layout(num_residues: int, charge: int) -> np.ndarray:
+    """
+    Returns an ION_DT template with the type_code, length and charge fields
+    shared by every peptide with num_residues residues (mz is left at zero),
+    in the order produced by _ion_table.
+    """
+    # b is [b1, b2, ... b(n-1)]
+    # y is [y(n-1), y(n-2), ... y1, yn]
+    lengths = np.concatenate((
+        np.arange(1, num_residues),
+        np.arange(num_residues - 1, 0, -1),
+        [num_residues],
+    ))
+    type_codes = np.repeat(np.arange(len(ION_TYPES)), [num_residues - 1, num_residues])
+    
+    layout = np.zeros(len(lengths) * charge, dtype=ION_DT)
+    layout['type_code'] = np.repeat(type_codes, charge)
+    layout['length'] = np.repeat(lengths, charge)
+    layout['charge'] = np.tile(np.arange(1, charge + 1), len(lengths))
+    layout.flags.writeable = False
+    return layout
+
+@lru_cache(maxsize=ION_CACHE_SIZE)
+def _ion_table(sequence: str, charge: int) -> np.ndarray:
+    """
+    Computes all theoretical ions as one ION_DT record array,
+    ordered b then y, charge varying fastest.
+    Results are cached and returned read-only, so callers must not modify them.
+    """
+    ladder = pep_by_ion_calc(sequence)
+    num_residues = len(ladder.y)
+    
+    if num_residues == 0 or charge < 1:
+        return np.empty(0, dtype=ION_DT)
+    
+    # Masses are singly charged (MH+), m = Neutral + H, so
+    # mz = (Neutral + zH) / z = (m + (z-1)H) / z
+    # Outer product over (ion, charge), written into one buffer
+    # so no per-charge copies or intermediate stacks are allocated
+    z = np.arange(1, charge + 1)
+    proton_offsets = (z - 1) * PROTON_MASS
+    num_b = len(ladder.b)
+    mz = np.empty((num_b + len(ladder.y), charge), dtype=np.float64)
+    np.add(ladder.b[:, None], proton_offsets, out=mz[:num_b])
+    np.add(ladder.y[:, None], proton_offsets, out=mz[num_b:])
+    mz /= z
+    
+    # Label fields come from the cached template; only the mz column is filled in
+    ions = _ion_layout(num_residues, charge).copy()
+    ions['mz'] = mz.reshape(-1)
+    ions.flags.writeable = False
+    return ions
+
+def calculate_ions(sequence: str, charge: int) -> IonArray:
+    """
+    Calculates theoretical ions using the robust PTM parser.
+    All (ion, charge) m/z values are computed in a single NumPy broadcast.
+    """
+    return IonArray(records=_ion_table(_canonical_peptide(sequence), charge))
+
+# First two whitespace-separated fields of a peak line
+PEAK_LINE_PATTERN = re.compile(r'\s*(\S+)\s+(\S+)')
+
+def parse_spectrum(spectrum_text: str) -> PeakArray:
+    """
+    Parses "m/z intensity" lines into a PeakArray.
+    Extra columns are ignored and malformed lines are skipped.
+    """
+    text = spectrum_text.strip()
+    arr = np.empty((0, 2), dtype=np.float64)
+    
+    if text:
+        try:
+            arr = np.loadtxt(io.StringIO(text), usecols=(0, 1), dtype=np.float64, ndmin=2)
+        except ValueError:
+            # Malformed input: fall back to line-by-line parsing, skipping bad lines
+            rows = []
+            for line in text.splitlines():
+                match = PEAK_LINE_PATTERN.match(line)
+                if match:
+                    try:
+                        rows.append((float(match.group(1)), float(match.group(2))))
+                    except ValueError:
+                        pass
+            arr = np.array(rows, dtype=np.float64).reshape(-1, 2)
+            
+    return PeakArray(mz=arr[:, 0].copy(), intensity=arr[:, 1].copy())
+
+def _match_candidates_np(sorted_mz, ion_mz, tolerance):
+    """
+    Returns flat (ion index, sorted peak position, |diff|) arrays for every
+    ion/peak pair within tolerance, ion-major.
+    """
+    # Window [lo, hi) of sorted peaks within tolerance of each ion
+    lo = np.searchsorted(sorted_mz, ion_mz - tolerance, side="left")
+    hi = np.searchsorted(sorted_mz, ion_mz + tolerance, side="right")
+    counts = hi - lo
+    
+    # Expand the windows into flat candidate arrays
+    cand_ion = np.repeat(np.arange(len(ion_mz)), counts)
+    window_start = np.cumsum(counts) - counts
+    cand_pos = lo[cand_ion] + (np.arange(len(cand_ion)) - window_start[cand_ion])
+    cand_diff = np.abs(sorted_mz[cand_pos] - ion_mz[cand_ion])
+    
+    in_tol = cand_diff <= tolerance
+    return cand_ion[in_tol], cand_pos[in_tol], cand_diff[in_tol]
+
+def _match_candidates_kernel(sorted_mz, ion_mz, tolerance):
+    """
+    Same result as _match_candidates_np, computed per ion for numba:
+    one pass counts each ion's candidates, a second fills them in at
+    offsets given by the prefix sum of the counts. Both passes are
+    independent per ion and run on all cores when compiled with parallel=True.
+    """
+    num_ions = len(ion_mz)
+    num_peaks = len(sorted_mz)
+    lo = np.searchsorted(sorted_mz, ion_mz - tolerance)
+    
+    counts = np.zeros(num_ions, dtype=np.int64)
+    for i in prange(num_ions):
+        j = lo[i]
+        while j < num_peaks and sorted_mz[j] <= ion_mz[i] + tolerance:
+            if abs(sorted_mz[j] - ion_mz[i]) <= tolerance:
+                counts[i] += 1
+            j += 1
+            
+    offsets = np.cumsum(counts) - counts
+    total = offsets[-1] + counts[-1] if num_ions > 0 else 0
+    cand_ion = np.empty(total, dtype=np.int64)
+    cand_pos = np.empty(total, dtype=np.int64)
+    cand_diff = np.empty(total, dtype=np.float64)
+    
+    for i in prange(num_ions):
+        k = offsets[i]
+        j = lo[i]
+        while j < num_peaks and sorted_mz[j] <= ion_mz[i] + tolerance:
+            diff = abs(sorted_mz[j] - ion_mz[i])
+            if diff <= tolerance:
+                cand_ion[k] = i
+                cand_pos[k] = j
+                cand_diff[k] = diff
+                k += 1
+            j += 1
+            
+    return cand_ion, cand_pos, cand_diff
+
+if njit is not None:
+    _match_candidates_serial = njit(cache=True)(_match_candidates_kernel)
+    _match_candidates_parallel = njit(parallel=True, cache=True)(_match_candidates_kernel)
+
+# Below this many ions, starting the parallel workers costs more than it saves
+PARALLEL_MATCH_MIN_IONS = 4096
+
+def _match_candidates(sorted_mz, ion_mz, tolerance):
+    if njit is None:
+        return _match_candidates_np(sorted_mz, ion_mz, tolerance)
+    if len(ion_mz) >= PARALLEL_MATCH_MIN_IONS:
+        return _match_candidates_parallel(sorted_mz, ion_mz, tolerance)
+    return _match_candidates_serial(sorted_mz, ion_mz, tolerance)
+
+def _greedy_assign(cand_ion, cand_peak, order, num_ions, num_peaks):
+    """
+    Walks candidate (ion, peak) pairs in the given order (closest first) and
+    accepts a pair only when neither its ion nor its peak is already taken.
+    Returns a boolean mask over the candidates.
+    """
+    used_ion = np.zeros(num_ions, dtype=np.bool_)
+    used_peak = np.zeros(num_peaks, dtype=np.bool_)
+    accepted = np.zeros(len(order), dtype=np.bool_)
+    
+    for k in order:
+        i = cand_ion[k]
+        p = cand_peak[k]
+        if not used_ion[i] and not used_peak[p]:
+            used_ion[i] = True
+            used_peak[p] = True
+            accepted[k] = True
             
-    return matches
+    return accepted
+
+if njit is not None:
+    _greedy_assign = njit(cache=True)(_greedy_assign)
 
+def match_ions(peaks: PeakArray, theoretical_ions: IonArray, tolerance=0.5) -> MatchArray:
+    """
+    Matches theoretical ions to observed peaks within a tolerance (Da).
+    Greedy one-to-one matching: every (ion, peak) pair within tolerance is a
+    candidate, and candidates are accepted closest first as long as neither
+    the ion nor the peak has been claimed. Candidate windows are found with a
+    binary search over the m/z-sorted peaks.
+    Matches are returned in theoretical ion order.
+    """
+    order = np.argsort(peaks.mz, kind="stable")
+    sorted_mz = peaks.mz[order]
+    # Field views into the ion records are strided; scan a contiguous copy
+    ion_mz = np.ascontiguousarray(theoretical_ions.mz)
+    
+    cand_ion, cand_pos, cand_diff = _match_candidates(sorted_mz, ion_mz, float(tolerance))
+    
+    accepted = _greedy_assign(
+        cand_ion, cand_pos, np.argsort(cand_diff, kind="stable"), len(ion_mz), len(sorted_mz)
+    )
+    keep = np.flatnonzero(accepted)
+    hit = cand_ion[keep]
+    peak_index = order[cand_pos[keep]]
+    
+    return MatchArray(
+        peak_index=peak_index,
+        peak_mz=peaks.mz[peak_index],
+        peak_intensity=peaks.intensity[peak_index],
+        ion_type_code=theoretical_ions.type_code[hit],
+        ion_length=theoretical_ions.length[hit],
+        ion_charge=theoretical_ions.charge[hit],
+        theoretical_mz=ion_mz[hit],
+        error=cand_diff[keep],
+    )
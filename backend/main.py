@@ -1,19 +1,34 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Query
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional
+from functools import lru_cache
+import asyncio
 import os
 import shutil
 from pathlib import Path
 
-from .calculations import calculate_ions, match_ions
-from .mzml import LazyMzmlReader
+import orjson
+
+from .cache import LRUCache
+from .calculations import ION_CACHE_SIZE, PeakArray, calculate_ions, match_ions
+from .mzml import PEAK_DTYPE, LazyMzmlReader, open_mzml
 from .pin_parser import parse_pin
 
-app = FastAPI()
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson (NumPy arrays are serialized natively).
+    Returning it directly from an endpoint skips FastAPI's jsonable_encoder pass.
+    """
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
-# Global state
-ACTIVE_READER: Optional[LazyMzmlReader] = None
+# Global state: readers are cached per file in mzml.open_mzml; this is only the
+# default file for spectrum requests that do not name one
+LAST_MZML_PATH: Optional[str] = None
 
 # Input model for local loading
 class LocalLoadRequest(BaseModel):
@@ -28,9 +43,50 @@ class IonMatch(BaseModel):
     theoretical_mz: float
     error: float
 
+def _file_key(path: str):
+    """
+    Identifies a file by (absolute path, mtime, size) so cached results
+    are dropped as soon as the file changes on disk.
+    """
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+# Number of parsed PIN file versions kept in memory
+PIN_CACHE_SIZE = 8
+
+@lru_cache(maxsize=PIN_CACHE_SIZE)
+def _load_pin(path: str, mtime_ns: int, size: int) -> list:
+    return parse_pin(path)
+
+def _get_reader(path: str) -> LazyMzmlReader:
+    # Readers are cached in mzml.open_mzml, which replaces one as soon as its file changes
+    abspath, mtime_ns, _ = _file_key(path)
+    return open_mzml(abspath, mtime_ns, PEAK_DTYPE)
+
+# Strong references to fire-and-forget tasks so they are not garbage collected
+_BACKGROUND_TASKS = set()
+# PIN file versions whose ions have already been warmed, bounded like _load_pin
+# so a PIN that has dropped out of both caches is warmed again on reload
+_WARMED_PINS = LRUCache(max_items=PIN_CACHE_SIZE)
+
+def _warm_ion_cache(peptides: list):
+    """
+    Precomputes theoretical ions for the loaded peptides at their precursor
+    charge, so the first /api/spectrum request for each one hits a warm cache.
+    Stops once the ion cache would be full, to avoid evicting its own entries.
+    Runs on one worker thread: the work holds the GIL, so more threads would
+    only compete with the request handlers.
+    """
+    pairs = list(dict.fromkeys(
+        (p["sequence"], p["charge"]) for p in peptides
+    ))[:ION_CACHE_SIZE]
+    
+    for sequence, charge in pairs:
+        calculate_ions(sequence, charge)
+
 @app.post("/api/load_local")
 async def load_local_files(request: LocalLoadRequest):
-    global ACTIVE_READER
+    global LAST_MZML_PATH
     
     try:
         # Validate paths
@@ -39,54 +95,107 @@ async def load_local_files(request: LocalLoadRequest):
         if not os.path.exists(request.pin_path):
             raise HTTPException(status_code=400, detail=f"PIN file not found: {request.pin_path}")
             
-        # Parse PIN (from local path)
-        peptides = parse_pin(request.pin_path)
+        # Parse PIN (from local path), reusing the result while the file is unchanged
+        pin_key = _file_key(request.pin_path)
+        peptides = _load_pin(*pin_key)
+        
+        # Initialize Reader (indexes the file from local path, once per file version)
+        _get_reader(request.mzml_path)
+        LAST_MZML_PATH = request.mzml_path
         
-        # Initialize Reader (indexes the file from local path)
-        ACTIVE_READER = LazyMzmlReader(request.mzml_path)
+        # Precompute ions in the background once per PIN version; the response does not wait for it
+        if _WARMED_PINS.get(pin_key) is None:
+            _WARMED_PINS.put(pin_key, True)
+            task = asyncio.create_task(asyncio.to_thread(_warm_ion_cache, peptides))
+            _BACKGROUND_TASKS.add(task)
+            task.add_done_callback(_BACKGROUND_TASKS.discard)
         
-        return {
+        return ORJSONResponse({
             "status": "success",
             "peptides": peptides,
             "message": f"Loaded {len(peptides)} peptides from {os.path.basename(request.pin_path)}"
-        }
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _resolve_mzml_path(mzml_path: Optional[str]) -> str:
+    path = mzml_path or LAST_MZML_PATH
+    
+    if path is None:
+        raise HTTPException(status_code=400, detail="No mzML file loaded.")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=400, detail=f"mzML file not found: {path}")
+    return path
+
 @app.get("/api/spectrum/{scan_nr}")
 async def get_spectrum(
     scan_nr: int,
     sequence: str = Query(..., description="Peptide sequence for annotation"),
     charge: int = Query(..., description="Precursor charge for annotation"),
-    tolerance: float = Query(0.5, description="Matching tolerance")
+    tolerance: float = Query(0.5, description="Matching tolerance"),
+    mzml_path: Optional[str] = Query(None, description="mzML file to read (defaults to the last loaded file)")
 ):
-    global ACTIVE_READER
+    path = _resolve_mzml_path(mzml_path)
     
-    if ACTIVE_READER is None:
-        raise HTTPException(status_code=400, detail="No mzML file loaded.")
-        
     try:
-        # 1. Lazy load spectrum
-        peaks = ACTIVE_READER.get_spectrum(scan_nr)
+        # 1. Lazy load spectrum (the file is only indexed on first use)
+        reader = _get_reader(path)
+        spectrum = reader.get_spectrum(scan_nr)
         
-        if peaks is None:
+        if spectrum is None:
             raise HTTPException(status_code=404, detail=f"Scan {scan_nr} not found in mzML.")
             
+        peaks = PeakArray.from_arrays(spectrum["mz"], spectrum["intensity"], PEAK_DTYPE)
+        
         # 2. Calculate Theoretical Ions
         theoretical_ions = calculate_ions(sequence, charge)
         
         # 3. Match
         matches = match_ions(peaks, theoretical_ions, tolerance)
         
-        return {
+        # Columns are only converted to JSON-friendly dicts at the response boundary
+        return ORJSONResponse({
             "scan_nr": scan_nr,
-            "peaks": peaks,
-            "matches": matches
-        }
+            # Columnar peaks; orjson writes the arrays without Python floats
+            "peaks": {"mz": peaks.mz, "intensity": peaks.intensity},
+            "matches": matches.to_dicts()
+        })
         
+    except HTTPException:
+        # The 404 for an unknown scan, not an internal error
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/spectrum/{scan_nr}/peaks")
+async def get_spectrum_peaks(
+    scan_nr: int,
+    mzml_path: Optional[str] = Query(None, description="mzML file to read (defaults to the last loaded file)")
+):
+    """
+    Raw peaks as application/octet-stream: N little-endian float32 m/z values
+    followed by N float32 intensities, with N in the X-Peak-Count header.
+    Decode in the browser with new Float32Array(buffer, 0, n) and
+    new Float32Array(buffer, 4 * n, n).
+    """
+    path = _resolve_mzml_path(mzml_path)
+    
+    try:
+        spectrum = _get_reader(path).get_spectrum(scan_nr)
+        # Arrays are decoded here, on first access
+        peaks = PeakArray.from_arrays(spectrum["mz"], spectrum["intensity"], PEAK_DTYPE) if spectrum is not None else None
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+        
+    if peaks is None:
+        raise HTTPException(status_code=404, detail=f"Scan {scan_nr} not found in mzML.")
+        
+    return Response(
+        content=peaks.mz.astype('<f4').tobytes() + peaks.intensity.astype('<f4').tobytes(),
+        media_type="application/octet-stream",
+        headers={"X-Peak-Count": str(len(peaks))},
+    )
 
 # Mount static files (Frontend)
 if os.path.exists("frontend"):
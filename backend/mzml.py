@@ -3,15 +3,34 @@ mzML file processing module with lazy loading capabilities.
 """
 
 import base64
+import hashlib
 import logging
+import mmap
+import os
+import threading
 import zlib
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, Union, Tuple
+from typing import Callable, Dict, Iterable, Optional, Union, Tuple
 import re
 
 import numpy as np
 from lxml import etree
 
+from .cache import LRUCache
+
+try:
+    import pybase64 as b64
+except ImportError:
+    b64 = base64
+
+try:
+    from isal import isal_zlib as inflate
+except ImportError:
+    inflate = zlib
+
 logger = logging.getLogger(__name__)
 
 # Constants for decoding
@@ -28,18 +47,125 @@ COMPRESSION_MAPPING = {
     'zlib': 'zlib',
 }
 
+# cvParam accession -> (array state key, value) for binaryDataArray descriptors
+CV_ACTIONS = {
+    'MS:1000514': ('is_mz', True), # m/z array
+    'MS:1000515': ('is_int', True), # intensity array
+    'MS:1000523': ('dtype', '64d'),
+    'MS:1000521': ('dtype', '32f'),
+    'MS:1000574': ('compression', 'zlib'),
+    'MS:1000576': ('compression', 'none'),
+}
+DEFAULT_ARRAY_STATE = {'is_mz': False, 'is_int': False, 'dtype': '32f', 'compression': 'none'}
+
+# Qualified tag -> local name for the elements the spectrum parser acts on.
+# Un-namespaced variants cover files written without the mzML xmlns.
+MZML_NS = 'http://psi.hupo.org/ms/mzml'
+SPECTRUM_TAGS = {
+    f'{{{MZML_NS}}}{name}' if ns else name: name
+    for name in ('spectrum', 'binaryDataArray', 'cvParam', 'binary')
+    for ns in (True, False)
+}
+
+# indexedmzML stores the byte offset of <indexList> just before </indexedmzML>
+INDEX_LIST_OFFSET_PATTERN = re.compile(rb'<indexListOffset>\s*([0-9]+)\s*</indexListOffset>')
+SCAN_ID_PATTERN = re.compile(r'scan=([0-9]+)')
+# <spectrum ... id="... scan=N"> start tags, for files without an index
+SPECTRUM_TAG_PATTERN = re.compile(rb'<spectrum\s+[^>]*id="[^"]*scan=([0-9]+)"')
+# Bytes read from the end of the file when looking for <indexListOffset>
+INDEX_TAIL_SIZE = 4096
+# Directory for files caching scan indexes between runs, one per mzML path.
+# Unset disables the cache; nothing is ever written next to the mzML files.
+INDEX_CACHE_DIR = os.environ.get("PROTVIEW_INDEX_CACHE_DIR") or None
+INDEX_CACHE_SUFFIX = '.pvidx.npz'
+# Number of indexed, memory-mapped readers kept open by open_mzml
+READER_CACHE_SIZE = 16
+# Memory budget per reader for decoded m/z arrays shared between spectra with
+# identical payloads (DIA/SRM grids). Off by default: DDA spectra rarely repeat.
+MZ_CACHE_BYTES = int(float(os.environ.get("PROTVIEW_MZ_CACHE_MB", 0)) * 1024 * 1024)
+# Float dtypes peaks can be decoded to and served in; narrower or integer
+# types would lose m/z precision or overflow intensities
+PEAK_DTYPES = ('float32', 'float64')
+# Float dtype the server serves peaks in. "float32" also makes the readers
+# it opens downcast 64-bit arrays on decode; float64 leaves them as stored.
+_peak_dtype = os.environ.get("PROTVIEW_PEAK_DTYPE") or 'float64'
+if _peak_dtype not in PEAK_DTYPES:
+    raise ValueError(f"PROTVIEW_PEAK_DTYPE must be one of {', '.join(PEAK_DTYPES)}, got {_peak_dtype!r}")
+PEAK_DTYPE = np.dtype(_peak_dtype)
+
+class Spectrum(Mapping):
+    """
+    Peak arrays of one spectrum, keyed "mz" and "intensity".
+    Each array is base64/zlib decoded on first access and memoized, so
+    callers that only need spectrum["mz"] never decode the intensities.
+    A missing array reads as an empty one.
+    """
+    KEYS = ("mz", "intensity")
+
+    def __init__(self, encoded: Dict[str, tuple], decode: Callable[..., np.ndarray]):
+        self._encoded = encoded # key -> (base64 text, dtype, compression, n_values)
+        self._decode = decode
+        self._decoded: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_arrays(cls, mz: np.ndarray, intensity: np.ndarray) -> "Spectrum":
+        spectrum = cls({}, None)
+        spectrum._decoded = {"mz": mz, "intensity": intensity}
+        return spectrum
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        arr = self._decoded.get(key)
+        if arr is None:
+            if key not in self.KEYS:
+                raise KeyError(key)
+            encoded = self._encoded.get(key)
+            arr = self._decode(key, *encoded) if encoded else np.array([])
+            self._decoded[key] = arr
+        return arr
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self) -> int:
+        return len(self.KEYS)
+
+    def decode(self) -> "Spectrum":
+        """
+        Decodes every array now (e.g. inside a worker thread).
+        """
+        for key in self.KEYS:
+            self[key]
+        return self
+
 class LazyMzmlReader:
     """
     Reads mzML files on demand using an index of scan offsets.
     Does NOT load the entire file into memory.
     """
 
-    def __init__(self, file_path: Union[str, Path]):
+    def __init__(self, file_path: Union[str, Path], downcast: Optional[np.dtype] = None):
+        """
+        downcast: optional float32 or float64 dtype that wider decoded
+        float arrays are cast to; float32 halves their memory and transfer
+        size. Leave unset for high-resolution data that needs full 64-bit m/z.
+        """
         self.file_path = Path(file_path)
+        self.downcast = np.dtype(downcast) if downcast is not None else None
+        if self.downcast is not None and self.downcast.name not in PEAK_DTYPES:
+            raise ValueError(f"downcast must be one of {', '.join(PEAK_DTYPES)}, got {self.downcast}")
         if not self.file_path.exists():
             raise FileNotFoundError(f"File not found: {self.file_path}")
         
         self.scan_index: Dict[int, int] = {} # scan_nr -> byte_offset
+        # One pull parser per thread, reused for every spectrum fragment
+        self._local = threading.local()
+        # Decoded m/z arrays by payload digest, shared read-only between spectra
+        self._mz_cache = LRUCache(max_bytes=MZ_CACHE_BYTES, sizeof=lambda arr: arr.nbytes) if MZ_CACHE_BYTES > 0 else None
+        
+        # Read-only memory map of the whole file; pages are only loaded when touched
+        with open(self.file_path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            
         self._build_index()
 
     def _build_index(self):
@@ -48,226 +174,328 @@ class LazyMzmlReader:
         Tries to use the native mzML index if available (usually at end of file).
         If not, performs a linear scan of spectrum tags (still fast-ish).
         """
-        logger.info(f"Indexing {self.file_path}...")
-        
-        # Simple regex strategy for robustness if XML parsing whole structure is too heavy
-        # We look for <spectrum ... id="...">
-        # or use lxml iterparse skipping content.
-        
-        # Using lxml iterparse with 'start' event to get positions
-        # Note: iterparse might be slow for huge files if we process everything. 
-        # But it's standard. Let's try optimized read.
-        
-        scan_pattern = re.compile(rb'<spectrum [^>]*id="[^"]*scan=([0-9]+)"[^>]*>')
-        # Alternative pattern for generic IDs if scan= is missing? 
-        # User prompt specified "locate the spectrum location".
-        
-        # Let's try a hybrid approach: Read file line by line (or chunk binary) to find offsets?
-        # Actually, standard mzML often has an indexed list at the end.
-        # But writing a robust parser for the tail index is complex.
-        # Let's stick to a linear scan using iterparse but clearing elements to save memory.
-        # However, getting *byte offsets* from iterparse is tricky (sourceline is strictly line number).
+        if not self._load_index_cache():
+            logger.info(f"Indexing {self.file_path}...")
+            
+            if not self._read_index_list():
+                self._scan_spectrum_offsets()
+                
+            self._save_index_cache()
+            
+        # Sorted start offsets; the next one bounds the search for </spectrum>
+        self._offsets = np.sort(np.fromiter(self.scan_index.values(), dtype=np.int64, count=len(self.scan_index)))
         
-        # Better approach for Random Access:
-        # We need the BYTE OFFSET.
-        # Let's verify if 'indexedmzML' schema is used.
+        logger.info(f"Indexed {len(self.scan_index)} scans.")
+
+    @property
+    def _index_cache_path(self) -> Optional[Path]:
+        if INDEX_CACHE_DIR is None:
+            return None
+        # Named by a hash of the resolved path, so any mzML maps to one flat file name
+        digest = hashlib.sha256(str(self.file_path.resolve()).encode('utf-8')).hexdigest()[:32]
+        return Path(INDEX_CACHE_DIR) / f"{digest}{INDEX_CACHE_SUFFIX}"
+
+    def _load_index_cache(self) -> bool:
+        """
+        Loads scan_index from the index cache if it is strictly newer than the mzML
+        and was built for the same path and file size.
+        """
+        cache_path = self._index_cache_path
+        if cache_path is None:
+            return False
         try:
-            with open(self.file_path, 'rb') as f:
-                # Naive greedy scan for '<spectrum' tags and extracting ID.
-                # This works for uncompressed XML mzML.
-                # For huge files this takes a few seconds.
-                mm = f.read() # WARNING: Reading WHOLE file into RAM? 
-                # User said "Do not read the whole file". We CANNOT read into memory.
-                
-                # Stream read
-                f.seek(0)
-                pos = 0
-                while True:
-                    chunk = f.read(1024 * 1024 * 10) # 10MB chunks
-                    if not chunk:
-                        break
-                        
-                    # Find all matches in this chunk
-                    # Use finditer
-                    for match in scan_pattern.finditer(chunk):
-                        # Calculate absolute position
-                        # match.start() is relative to chunk
-                        # CAREFUL: Matches traversing chunk boundaries? 
-                        # This naive chunking splits tags.
-                        pass
-                
-                # RE-EVALUATION: lxml iterparse usually handles file streaming.
-                # But it doesn't give byte offsets easily.
-                
-                # Let's assume standard mzML.
-                # We will index via `lxml`'s `iterparse`? No, we need random access later.
-                # If we use `lxml` later to parse *just* the spectrum, we can pass a file handle 
-                # seeked to that position? `etree.parse` expects a file-like object.
-                
-                # SOLUTION: Indexing is done once. We iterate the file using `etree.iterparse`.
-                # We store the `scan_nr` -> `offset` MAPPING?
-                # Actually, `iterparse` yields elements. Getting the file position of an element is hard.
-                
-                # Alternative: Just use the `mzml.py` provided by the user (which was in the repo)?
-                # The user pointed to a repo: `mscompress`.
-                # The local file I checked `mzml.py` had `MzMLProcessor` which read EVERYTHING.
-                # User specifically asked to CHANGE it to lazy load.
-                
-                # Let's use `pylib.seek`? No.
-                # For lazy loading XML, the <indexList> at the end is the official way.
-                # If that exists, we parse it.
-                # If not, strictly needed? 
-                
-                # Fallback: We will build a rudimentary index by reading the file line-by-line (binary mode)
-                # and looking for `<spectrum ... index="x" ... id="... scan=Y ...">`.
-                # We record `f.tell()` start positions.
+            if cache_path.stat().st_mtime_ns <= self.file_path.stat().st_mtime_ns:
+                return False
+            with np.load(cache_path) as cache:
+                if int(cache['file_size']) != len(self._mm) or str(cache['file_path']) != str(self.file_path.resolve()):
+                    return False
+                self.scan_index = dict(zip(cache['scan_nrs'].tolist(), cache['offsets'].tolist()))
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def _save_index_cache(self):
+        """
+        Writes scan_index to the index cache, if one is configured. Failures
+        (e.g. a read-only directory) only cost a rebuild next time.
+        """
+        cache_path = self._index_cache_path
+        if cache_path is None:
+            return
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    scan_nrs=np.fromiter(self.scan_index.keys(), dtype=np.int64, count=len(self.scan_index)),
+                    offsets=np.fromiter(self.scan_index.values(), dtype=np.int64, count=len(self.scan_index)),
+                    file_size=np.int64(len(self._mm)),
+                    file_path=np.str_(self.file_path.resolve()),
+                )
+            # Atomic so a concurrent reader never sees a partial file
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write index cache {cache_path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
                 pass
-                
-        except Exception:
+
+    def _read_index_list(self) -> bool:
+        """
+        Reads spectrum offsets from the <indexList> of an indexedmzML file.
+        Only the last few KB and the index itself are touched.
+        Returns False if the file has no usable index.
+        """
+        mm = self._mm
+        tail_start = max(0, len(mm) - INDEX_TAIL_SIZE)
+        match = None
+        for match in INDEX_LIST_OFFSET_PATTERN.finditer(mm, tail_start):
             pass
+        if match is None:
+            return False
             
-        # Re-implementation: Proper Lazy loading
-        # 1. Parse ONLY the index (if exists).
-        # 2. If no index, scan file once to build it.
-        
-        self.scan_index = {}
-        with open(self.file_path, 'rb') as f:
-            # We will use a regex on the stream.
-            # To handle boundary issues, we keep a small overlap buffer.
-            buffer_size = 1024 * 1024 * 5 # 5MB
-            overlap = 1024 # Enough for a tag
+        index_start = int(match.group(1))
+        index_end = mm.find(b'</indexList>', index_start, match.start())
+        if index_end < 0:
+            return False
             
-            offset = 0
-            buffer = b""
+        try:
+            index_list = etree.fromstring(mm[index_start:index_end + len(b'</indexList>')])
+        except etree.XMLSyntaxError:
+            return False
             
-            while True:
-                f.seek(offset)
-                new_data = f.read(buffer_size)
-                if not new_data:
-                    break
-                
-                data_to_search = buffer + new_data
-                
-                # Find tags
-                # Look for start of spectrum: <spectrum
-                # We need the ID as well.
-                # Regex: <spectrum [^>]*index="(\d+)"[^>]*id="[^"]*scan=(\d+)"
-                # This regex captures scan number.
-                
-                # Note: 'index' attribute is sequential 0..N. 'id' contains 'scan=X'.
-                # We want scan=X.
-                
-                # Simple iterator
-                for match in re.finditer(rb'<spectrum\s+[^>]*id="[^"]*scan=([0-9]+)"', data_to_search):
-                    scan_nr = int(match.group(1))
-                    # The absolute offset of this match start
-                    # match.start() is relative to data_to_search
-                    # We accept this as the start of the spectrum block.
-                    abs_pos = offset - len(buffer) + match.start()
+        scan_index = {}
+        for index in index_list:
+            if index.get('name') != 'spectrum':
+                continue
+            # Walk the <offset idRef="... scan=N">BYTE_OFFSET</offset> children linearly
+            for offset in index:
+                scan_match = SCAN_ID_PATTERN.search(offset.get('idRef', ''))
+                if scan_match and offset.text:
+                    scan_index[int(scan_match.group(1))] = int(offset.text)
                     
-                    # Store scan_nr -> offset
-                    self.scan_index[scan_nr] = abs_pos
-                
-                # Setup next buffer
-                offset += len(new_data)
-                buffer = new_data[-overlap:] # Keep tail for overlap
-                
-        logger.info(f"Indexed {len(self.scan_index)} scans.")
+        # Some writers produce broken offsets; only trust the index if it points at spectra
+        if not scan_index:
+            return False
+        first_offset = next(iter(scan_index.values()))
+        if mm[first_offset:first_offset + len(b'<spectrum')] != b'<spectrum':
+            logger.warning(f"Ignoring invalid indexList in {self.file_path}")
+            return False
+            
+        self.scan_index = scan_index
+        return True
+
+    def _scan_spectrum_offsets(self):
+        """
+        Fallback for files without an index: regex scan over the whole file
+        for <spectrum ... id="... scan=N"> tags.
+        """
+        # Note: 'index' attribute is sequential 0..N. 'id' contains 'scan=X'.
+        # We want scan=X. The regex runs over the memory map directly.
+        self.scan_index = {
+            int(match.group(1)): match.start()
+            for match in SPECTRUM_TAG_PATTERN.finditer(self._mm)
+        }
 
-    def get_spectrum(self, scan_nr: int) -> Dict:
+    def get_spectrum(
+        self,
+        scan_nr: int,
+        min_intensity: Optional[float] = None,
+        mz_range: Optional[Tuple[float, float]] = None,
+    ) -> Optional[Spectrum]:
         """
         Fetches and parses a specific spectrum by scan number.
+        Returns a lazily decoded Spectrum, or None if the scan is not indexed.
+        Peaks with intensity <= min_intensity or m/z outside mz_range (inclusive) are dropped.
         """
         if scan_nr not in self.scan_index:
             return None # Or raise Error
             
-        offset = self.scan_index[scan_nr]
-        
-        # Read from file at offset until </spectrum>
-        chunk_size = 1024 * 10 
-        spectrum_xml_str = b""
+        start = self.scan_index[scan_nr]
         
-        with open(self.file_path, 'rb') as f:
-            f.seek(offset)
-            while True:
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
-                spectrum_xml_str += chunk
-                if b'</spectrum>' in chunk:
-                    # Cut at the end tag
-                    end_idx = spectrum_xml_str.find(b'</spectrum>') + len(b'</spectrum>')
-                    spectrum_xml_str = spectrum_xml_str[:end_idx]
-                    break
+        # Slice the spectrum straight out of the memory map, searching for
+        # </spectrum> no further than the start of the next spectrum
+        next_idx = np.searchsorted(self._offsets, start, side='right')
+        bound = int(self._offsets[next_idx]) if next_idx < len(self._offsets) else len(self._mm)
+        end = self._mm.find(b'</spectrum>', start, bound)
+        end = end + len(b'</spectrum>') if end >= 0 else bound
+        spectrum_xml_str = self._mm[start:end]
         
         # Now parse this single XML fragment
-        return self._parse_spectrum_xml(spectrum_xml_str)
+        spectrum = self._parse_spectrum_xml(spectrum_xml_str)
+        if min_intensity is None and mz_range is None:
+            return spectrum
+            
+        mz_array = spectrum["mz"]
+        int_array = spectrum["intensity"]
+        if len(mz_array) != len(int_array):
+            # Mismatched arrays mean no usable peaks
+            return Spectrum.from_arrays(np.array([]), np.array([]))
+        mask = np.ones(len(mz_array), dtype=bool)
+        if min_intensity is not None:
+            mask &= int_array > min_intensity
+        if mz_range is not None:
+            lo, hi = mz_range
+            mask &= (mz_array >= lo) & (mz_array <= hi)
+        return Spectrum.from_arrays(mz_array[mask], int_array[mask])
 
-    def _parse_spectrum_xml(self, xml_bytes: bytes) -> Dict:
+    def get_spectra(
+        self,
+        scan_nrs: Iterable[int],
+        max_workers: Optional[int] = None,
+        min_intensity: Optional[float] = None,
+        mz_range: Optional[Tuple[float, float]] = None,
+    ) -> Dict[int, Optional[Spectrum]]:
+        """
+        Fetches several spectra on a thread pool. Returns scan_nr -> spectrum
+        (None for unknown scans). Only part of the work runs in parallel:
+        zlib inflate (and pybase64, if installed) release the GIL, while XML
+        event handling and stdlib base64 decoding hold it, so the speed-up
+        is well below one per core.
+        """
+        def fetch(scan_nr: int) -> Optional[Spectrum]:
+            # Decode in the worker rather than lazily in the caller's thread
+            spectrum = self.get_spectrum(scan_nr, min_intensity, mz_range)
+            return spectrum.decode() if spectrum is not None else None
+            
+        scan_nrs = list(scan_nrs)
+        with ThreadPoolExecutor(max_workers or os.cpu_count()) as ex:
+            return dict(zip(scan_nrs, ex.map(fetch, scan_nrs)))
+
+    def close(self):
+        """
+        Releases the memory map. The reader cannot be used afterwards.
+        """
+        mm = getattr(self, '_mm', None)
+        if mm is not None and not mm.closed:
+            mm.close()
+
+    def __del__(self):
+        self.close()
+
+    def _parse_spectrum_xml(self, xml_bytes: bytes) -> Spectrum:
         """
         Parses a single <spectrum> element.
         """
-        parser = etree.XMLParser(recover=True)
-        root = etree.fromstring(xml_bytes, parser)
+        # Single pass over the fragment: cvParams set the flags of the
+        # binaryDataArray they belong to, which is recorded when it closes.
+        # Decoding is left to the Spectrum; other arrays are never decoded.
+        encoded = {}
         
-        ns = {'mzml': 'http://psi.hupo.org/ms/mzml'}
-        # Handle namespaces if present (usually is)
-        # Check if root has ns
-        if root.nsmap:
-            # Use the default namespace
-            ns = root.nsmap
-            if None in ns:
-                ns['x'] = ns.pop(None) # Remap default to 'x'
+        state = dict(DEFAULT_ARRAY_STATE)
+        binary_text = None
+        default_length = None # defaultArrayLength of the spectrum
+        array_length = None
         
-        # Find binary arrays
-        mz_array = np.array([])
-        int_array = np.array([])
-        
-        # Scan binaryDataArrayList
-        # Using verify-agnostic xpath or simple loop
-        # Because namespaces are annoying in lxml
-        
-        binary_data_list = root.findall(".//binaryDataArray", namespaces=ns) if not root.nsmap else \
-                           root.findall(".//{*}binaryDataArray")
-        
-        for bda in binary_data_list:
-            # Determine type (mz or int)
-            cv_params = bda.findall(".//{*}cvParam")
-            is_mz = False
-            is_int = False
-            dtype_map = '32f' # Default
-            compression = 'none'
-            
-            for cv in cv_params:
-                acc = cv.get('accession')
-                if acc == 'MS:1000514': is_mz = True # m/z array
-                if acc == 'MS:1000515': is_int = True # intensity array
-                if acc == 'MS:1000523': dtype_map = '64d'
-                if acc == 'MS:1000521': dtype_map = '32f'
-                if acc == 'MS:1000574': compression = 'zlib'
-                if acc == 'MS:1000576': compression = 'none'
+        pull = getattr(self._local, 'pull', None)
+        if pull is None:
+            # libxml2 filters out every other element before events reach Python
+            pull = self._local.pull = etree.XMLPullParser(events=('start', 'end'), recover=True, tag=list(SPECTRUM_TAGS))
+        try:
+            pull.feed(xml_bytes)
+            for event, elem in pull.read_events():
+                tag = SPECTRUM_TAGS[elem.tag]
                 
-            # Get binary data
-            bin_tag = bda.find(".//{*}binary")
-            if bin_tag is not None and bin_tag.text:
-                decoded = self._decode_data(bin_tag.text, dtype_map, compression)
-                if is_mz: mz_array = decoded
-                if is_int: int_array = decoded
+                if event == 'start':
+                    if tag == 'binaryDataArray':
+                        state = dict(DEFAULT_ARRAY_STATE)
+                        binary_text = None
+                        # An array may override the spectrum's length
+                        array_length = elem.get('arrayLength', default_length)
+                    elif tag == 'spectrum':
+                        default_length = elem.get('defaultArrayLength')
+                    continue
+                    
+                if tag == 'cvParam':
+                    action = CV_ACTIONS.get(elem.get('accession'))
+                    if action:
+                        state[action[0]] = action[1]
+                elif tag == 'binary':
+                    binary_text = elem.text
+                elif tag == 'binaryDataArray':
+                    if binary_text:
+                        n_values = int(array_length) if array_length else None
+                        array = (binary_text, state['dtype'], state['compression'], n_values)
+                        if state['is_mz']: encoded["mz"] = array
+                        if state['is_int']: encoded["intensity"] = array
+                        
+                    # Drop the finished array and its siblings from the tree
+                    elem.clear(keep_tail=False)
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+        finally:
+            # Resets the parser for the next spectrum
+            pull.close()
                 
-        # Create peaks list
-        peaks = []
-        if len(mz_array) == len(int_array) and len(mz_array) > 0:
-            # Filter zero intensity if needed?
-            # Basic dict list
-            peaks = [{"mz": float(m), "intensity": float(i)} for m, i in zip(mz_array, int_array)]
+        return Spectrum(encoded, self._decode_array)
+
+    def _decode_array(self, kind: str, b64_string: str, dtype_str: str, compression: str, n_values: Optional[int] = None) -> np.ndarray:
+        """
+        Decodes one array of a spectrum. When the m/z cache is enabled, m/z
+        arrays go through a byte-bounded LRU keyed on a digest of the encoded
+        payload, so identical m/z grids are decoded once and shared
+        (read-only) between spectra.
+        """
+        if kind != "mz" or self._mz_cache is None:
+            return self._decode_data(b64_string, dtype_str, compression, n_values)
             
-        return peaks
+        # A 128-bit digest keeps the key small; the payload text is not retained
+        digest = hashlib.blake2b(b64_string.encode('ascii', 'ignore'), digest_size=16).digest()
+        key = (digest, len(b64_string), dtype_str, compression, n_values)
+        arr = self._mz_cache.get(key)
+        if arr is None:
+            arr = self._decode_data(b64_string, dtype_str, compression, n_values)
+            arr.flags.writeable = False
+            self._mz_cache.put(key, arr)
+        return arr
 
-    def _decode_data(self, b64_string: str, dtype_str: str, compression: str) -> np.ndarray:
-        decoded = base64.b64decode(b64_string.encode('ascii'))
+    def _decode_data(self, b64_string: str, dtype_str: str, compression: str, n_values: Optional[int] = None) -> np.ndarray:
+        dt = np.dtype(NP_DTYPE_MAPPING.get(dtype_str, np.float32))
+        # Decoded size is known up front when the array length is given
+        out_bytes = n_values * dt.itemsize if n_values else 0
+        
+        # Both decoders accept the ASCII text as-is; the mzML payload is trusted
+        decoded = b64.b64decode(b64_string, validate=False)
         if compression == 'zlib':
-            decoded = zlib.decompress(decoded)
+            # Allocate the output buffer once instead of growing it
+            decoded = inflate.decompress(decoded, bufsize=out_bytes or inflate.DEF_BUF_SIZE)
+            
+        if out_bytes and out_bytes <= len(decoded):
+            arr = np.frombuffer(decoded, dtype=dt, count=n_values)
+        else:
+            arr = np.frombuffer(decoded, dtype=dt)
+            
+        if self.downcast is not None and dt.kind == 'f' and dt.itemsize > self.downcast.itemsize:
+            arr = arr.astype(self.downcast)
+        return arr
+
+# Open readers by (path, downcast) -> (st_mtime_ns, reader), least recently used first
+_READERS: "OrderedDict[Tuple[str, Optional[np.dtype]], Tuple[int, LazyMzmlReader]]" = OrderedDict()
+_READERS_LOCK = threading.Lock()
+
+def open_mzml(path: str, mtime_ns: int, downcast: Optional[np.dtype] = None) -> LazyMzmlReader:
+    """
+    Shared reader for the current version of an mzML file, so repeat requests
+    reuse its index and memory map. Call with the resolved path and the file's
+    current st_mtime_ns. A reader whose mtime no longer matches is closed and
+    replaced at once, so a rewritten or renamed-over file does not stay mapped;
+    readers beyond the READER_CACHE_SIZE most recently used are closed as well.
+    Callers must not keep a reader past the request that opened it.
+    """
+    key = (path, downcast)
+    with _READERS_LOCK:
+        entry = _READERS.pop(key, None)
+        if entry is not None:
+            if entry[0] == mtime_ns:
+                _READERS[key] = entry
+                return entry[1]
+            entry[1].close()
             
-        # Map dtype
-        dt = NP_DTYPE_MAPPING.get(dtype_str, np.float32)
-        return np.frombuffer(decoded, dtype=dt)
+        reader = LazyMzmlReader(path, downcast=downcast)
+        _READERS[key] = (mtime_ns, reader)
+        while len(_READERS) > READER_CACHE_SIZE:
+            _, (_, evicted) = _READERS.popitem(last=False)
+            evicted.close()
+        return reader
@@ -1,5 +1,46 @@
+import numpy as np
 import pandas as pd
 import os
+import re
+
+try:
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
+# Flanking residues as written by search engines, e.g. R.ACDE.K or -.ACDE.K
+_PEP_STRIP = re.compile(r'^[A-Z-]\.(.*)\.[A-Z-]$')
+# Brackets become parentheses for frontend compatibility
+_BRACKETS = str.maketrans('[]', '()')
+
+def _skip_long_rows(row) -> str:
+    # pyarrow cannot pad short rows like pandas does; erroring out sends the
+    # file down the pandas path so both readers return the same rows
+    return 'skip' if row.actual_columns > row.expected_columns else 'error'
+
+def _read_pin_table(file_path: str) -> pd.DataFrame:
+    """
+    Reads a .pin TSV into a DataFrame, using pyarrow's multi-threaded CSV
+    reader when it is installed. Rows with too many fields are skipped; rows
+    with too few are kept and padded with NaN (pandas behaviour).
+    """
+    if pacsv is not None:
+        try:
+            table = pacsv.read_csv(
+                file_path,
+                read_options=pacsv.ReadOptions(use_threads=True, block_size=8 << 20),
+                parse_options=pacsv.ParseOptions(delimiter='\t', invalid_row_handler=_skip_long_rows),
+            )
+            return table.to_pandas()
+        except Exception:
+            # e.g. a short row, or a column whose type changes after the first block; let pandas handle it
+            pass
+            
+    try:
+        return pd.read_csv(file_path, sep='\t', on_bad_lines='skip')
+    except Exception:
+         # Fallback engine
+         return pd.read_csv(file_path, sep='\t', engine='python')
 
 def parse_pin(file_path: str) -> list:
     """
@@ -16,14 +57,8 @@ def parse_pin(file_path: str) -> list:
             raise FileNotFoundError(f"PIN file not found: {file_path}")
 
         # Read TSV from file path
-        try:
-            df = pd.read_csv(file_path, sep='\t', on_bad_lines='skip')
-        except Exception:
-             # Fallback engine
-             df = pd.read_csv(file_path, sep='\t', engine='python')
+        df = _read_pin_table(file_path)
 
-        peptides = []
-        
         # Identify charge columns
         charge_cols = [c for c in df.columns if c.startswith('charge_')]
         
@@ -36,37 +71,28 @@ def parse_pin(file_path: str) -> list:
                  if col.lower() in pt_map:
                      df.rename(columns={pt_map[col.lower()]: col}, inplace=True)
         
-        for _, row in df.iterrows():
-            # Determine charge state
-            charge = 2 # Default fallback
-            for col in charge_cols:
-                if row[col] == 1:
-                    try:
-                        parts = col.split('_')
-                        if len(parts) >= 2 and parts[1].isdigit():
-                            charge = int(parts[1])
-                    except ValueError:
-                        pass
-                    break
-            
-            peptide_seq = str(row.get('Peptide', ''))
-            # Clean peptide sequence (remove flanking AA like R.ACDE.K)
-            if '.' in peptide_seq:
-                peptide_seq = peptide_seq[2:-3]
+        # Determine charge state: the first charge_N column set to 1, else 2
+        charges = np.full(len(df), 2, dtype=np.int64)
+        if charge_cols:
+            is_set = df[charge_cols].to_numpy() == 1
+            col_charges = np.array([int(c.split('_')[1]) if c.split('_')[1].isdigit() else 2 for c in charge_cols])
+            charges = np.where(is_set.any(axis=1), col_charges[is_set.argmax(axis=1)], charges)
             
-            # Replace brackets with parentheses for frontend compatibility
-            peptide_seq = peptide_seq.replace('[', '(').replace(']', ')')
-
-                
-            item = {
-                "scan_nr": int(row.get('ScanNr', 0)),
-                "spec_id": str(row.get('SpecId', '')),
-                "sequence": peptide_seq,
-                "charge": charge
-            }
-            peptides.append(item)
-            
-        return peptides
+        # Clean peptide sequences (remove flanking AA like R.ACDE.K) and
+        # replace brackets with parentheses for frontend compatibility
+        # Missing fields (short rows) become empty strings rather than NaN
+        sequences = df['Peptide'].fillna('').astype(str) if 'Peptide' in df.columns else pd.Series('', index=df.index)
+        sequences = sequences.str.replace(_PEP_STRIP, r'\1', regex=True).str.translate(_BRACKETS)
+        
+        scan_nrs = df['ScanNr'].astype(int) if 'ScanNr' in df.columns else pd.Series(0, index=df.index)
+        spec_ids = df['SpecId'].fillna('').astype(str) if 'SpecId' in df.columns else pd.Series('', index=df.index)
+        
+        return [
+            {"scan_nr": scan_nr, "spec_id": spec_id, "sequence": sequence, "charge": charge}
+            for scan_nr, spec_id, sequence, charge in zip(
+                scan_nrs.tolist(), spec_ids.tolist(), sequences.tolist(), charges.tolist()
+            )
+        ]
 
     except Exception as e:
         print(f"Error parsing PIN file: {e}")
@@ -17,6 +17,7 @@ if (readBtn) {
 
 // State
 let currentData = null;
+let currentMzmlPath = null; // mzML file the grid's peptides belong to
 
 async function handleReadLocal() {
     console.log("Read Local Clicked");
@@ -48,6 +49,7 @@ async function handleReadLocal() {
         }
 
         const data = await response.json();
+        currentMzmlPath = cleanMzml;
         renderAgGrid(data.peptides);
         showStatus(data.message, "success");
 
@@ -103,7 +105,8 @@ async function loadSpectrum(peptide) {
 
     try {
         // Fix encoding for sequences with brackets
-        const url = `/api/spectrum/${peptide.scan_nr}?sequence=${encodeURIComponent(peptide.sequence)}&charge=${peptide.charge}`;
+        let url = `/api/spectrum/${peptide.scan_nr}?sequence=${encodeURIComponent(peptide.sequence)}&charge=${peptide.charge}`;
+        if (currentMzmlPath) url += `&mzml_path=${encodeURIComponent(currentMzmlPath)}`;
         const response = await fetch(url);
 
         if (!response.ok) {
@@ -141,9 +144,10 @@ function renderPlot(data, sequence, charge) {
     const getMin = (arr) => { let m = Infinity; for (let v of arr) if (v < m) m = v; return m; };
     const getMax = (arr) => { let m = -Infinity; for (let v of arr) if (v > m) m = v; return m; };
 
-    const xPeaks = peaks.map(p => p.mz);
-    const yPeaks = peaks.map(p => p.intensity);
-    const hoverTexts = peaks.map(p => `m/z: ${p.mz.toFixed(4)}<br>Int: ${p.intensity.toFixed(1)}`);
+    // Peaks arrive as parallel columns: { mz: [...], intensity: [...] }
+    const xPeaks = peaks.mz;
+    const yPeaks = peaks.intensity;
+    const hoverTexts = xPeaks.map((mz, i) => `m/z: ${mz.toFixed(4)}<br>Int: ${yPeaks[i].toFixed(1)}`);
 
     const minMz = getMin(xPeaks);
     const maxMz = getMax(xPeaks);